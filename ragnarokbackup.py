@@ -3,13 +3,27 @@ import subprocess
 import tempfile
 import argparse
 import tarfile
-import filecmp
+import zipfile
 import shutil
 import json
+import re
+import stat
+import errno
+import time
 import sys
+import io
 import os
 import pwd
 import grp
+import atexit
+import functools
+import hashlib
+import struct
+import mmap
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # ANSI color codes
 class Colors:
@@ -22,90 +36,939 @@ class Colors:
     ENDC = '\033[0m'
     BOLD = '\033[1m'
 
+class BufferedPrinter:
+    """Collects per-file output and writes it from one background thread in large chunks.
+
+    Queued lines are flushed every `interval` seconds or once `limit` bytes are pending.
+    """
+
+    def __init__(self, interval=0.1, limit=64 << 10):
+        self.interval = interval
+        self.limit = limit
+        self.queue = deque()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def enqueue(self, msg, color):
+        line = f"{color}{msg}{Colors.ENDC}\n"
+        self.queue.append(line)
+        self.pending += len(line)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            atexit.register(self.flush)
+        if self.pending >= self.limit:
+            self.wakeup.set()
+
+    def flush(self):
+        with self.lock:
+            lines = []
+            while self.queue:
+                lines.append(self.queue.popleft())
+            self.pending = 0
+            if lines:
+                sys.stdout.write("".join(lines))
+                sys.stdout.flush()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+printer = BufferedPrinter()
+
 def cprint(msg, color):
+    # Immediate output, anything queued before it goes first
+    printer.flush()
     print(f"{color}{msg}{Colors.ENDC}")
 
+def load_zstandard():
+    """Return the optional zstandard module, or None to fall back to the zstd command."""
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        return None
+
+def load_lz4():
+    """Return the optional lz4.frame module, or None to fall back to the lz4 command."""
+    try:
+        import lz4.frame
+        return lz4.frame
+    except ImportError:
+        return None
+
+def load_orjson():
+    """Return the optional orjson module, or None to use the json module."""
+    try:
+        import orjson
+        return orjson
+    except ImportError:
+        return None
+
+def dump_json(obj):
+    """Serialize obj like json.dumps(obj, indent=2), as bytes."""
+    orjson = load_orjson()
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            # orjson rejects the surrogate escapes of non-UTF-8 file names
+            pass
+    return json.dumps(obj, indent=2).encode()
+
+def load_json(path):
+    with open(path, "rb") as f:
+        return parse_json(f.read())
+
+def parse_json(data):
+    """json.loads() for bytes, through orjson when it is available."""
+    orjson = load_orjson()
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+    return json.loads(data)
+
+def load_ijson():
+    """Return the optional ijson module, or None to load JSON files whole."""
+    try:
+        import ijson
+        return ijson
+    except ImportError:
+        return None
+
+# JSON objects from this size on are streamed when ijson is installed
+JSON_STREAM_MIN = 16 << 20
+
+def iter_json_items(path):
+    """Yield the (key, value) pairs of the JSON object stored at path."""
+    ijson = load_ijson() if os.path.getsize(path) >= JSON_STREAM_MIN else None
+    if ijson is None:
+        yield from load_json(path).items()
+        return
+    with open(path, "rb") as f:
+        yield from ijson.kvitems(f, "")
+
 def check_zstd():
     from shutil import which
-    if which("zstd") is None:
-        cprint("ERROR: zstd compression selected but 'zstd' is not installed or not in PATH.", Colors.FAIL)
+    if load_zstandard() is None and which("zstd") is None:
+        cprint("ERROR: zstd compression selected but neither the 'zstandard' Python module nor 'zstd' is installed.", Colors.FAIL)
         sys.exit(1)
 
-def get_archive_path(src_path, home):
-    src = Path(src_path)
-    # Handle /root
-    if str(src) == "/root" or str(src).startswith("/root/"):
-        rel = src.relative_to("/root")
-        return f"home_dirs/root/{rel}", "home_dirs"
-    # Handle /home/<username>
-    elif str(src).startswith("/home/"):
-        parts = src.parts
-        if len(parts) >= 3:
-            username = parts[2]
-            rel = Path(*parts[3:]) if len(parts) > 3 else Path()
-            return f"home_dirs/{username}/{rel}".rstrip("/"), "home_dirs"
+def check_lz4():
+    from shutil import which
+    if load_lz4() is None and which("lz4") is None:
+        cprint("ERROR: lz4 compression selected but neither the 'lz4' Python module nor 'lz4' is installed.", Colors.FAIL)
+        sys.exit(1)
+
+# Archive types restore can read
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tar.zst", ".tar.lz4")
+
+def check_decompressor(suffix):
+    """Exit if reading an archive with this suffix needs a tool that isn't installed."""
+    if suffix == ".tar.zst":
+        check_zstd()
+    elif suffix == ".tar.lz4":
+        check_lz4()
+
+# Files up to this size are read into memory by the prefetch workers
+READAHEAD_SIZE = 1 << 20
+# How much of a large file the kernel is asked to start reading before the
+# archive writer gets to it
+WILLNEED_SIZE = 8 << 20
+# Buffer for copying member data and for tar's stream (pipe) reads and writes,
+# tarfile and shutil default to 16-64 KiB
+COPY_BUFSIZE = 1 << 20
+
+def default_jobs():
+    return min(32, (os.cpu_count() or 4) * 2)
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1, such as --jobs."""
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}")
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
+
+def ordered_map(executor, fn, items, window):
+    """Like executor.map, but keeps at most `window` tasks in flight."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+# A backup usually involves a handful of owners, but every entry needs their
+# names and each getpwuid()/getgrgid() goes through NSS (re-reading /etc/passwd)
+@functools.lru_cache(maxsize=None)
+def user_name(uid):
+    return pwd.getpwuid(uid).pw_name
+
+@functools.lru_cache(maxsize=None)
+def group_name(gid):
+    return grp.getgrgid(gid).gr_name
+
+# The same lookups in reverse for restore, None when the name doesn't exist here
+@functools.lru_cache(maxsize=None)
+def user_id(name):
+    try:
+        return pwd.getpwnam(name).pw_uid
+    except KeyError:
+        return None
+
+@functools.lru_cache(maxsize=None)
+def group_id(name):
+    try:
+        return grp.getgrnam(name).gr_gid
+    except KeyError:
+        return None
+
+def perm_record(st):
+    return {
+        "mode": st.st_mode,
+        "uid": st.st_uid,
+        "gid": st.st_gid,
+        "user": user_name(st.st_uid),
+        "group": group_name(st.st_gid)
+    }
+
+def scan_tree(top, warnings):
+    """Yield a DirEntry for everything below top (depth-first, symlinks not followed).
+
+    Entry types come from the cached d_type of readdir, so no per-entry stat is needed.
+    An explicit stack instead of recursion keeps deep trees off the Python call
+    stack and avoids passing every entry up through one generator per level.
+    """
+    stack = [top]
+    while stack:
+        current = stack.pop()
+        subdirs = []
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    yield entry
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+        except OSError as e:
+            warnings.append(f"Skipping unreadable directory {current}: {e}")
+        # Reversed, so subdirectories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+def try_stat(path):
+    """os.stat() that returns None instead of raising for missing paths."""
+    try:
+        return os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def scan_existing(paths, listed_dirs=None):
+    """Return the subset of paths that exist, listing each parent directory only once.
+
+    Parent directories that could be listed are added to listed_dirs, if given.
+    Paths under a parent that can't be listed (no read permission) are lstat()ed
+    one by one instead.
+    """
+    by_parent = {}
+    for p in paths:
+        parent, name = os.path.split(p)
+        by_parent.setdefault(parent, set()).add(name)
+    existing = set()
+    for parent, names in by_parent.items():
+        try:
+            with os.scandir(parent) as it:
+                existing.update(entry.path for entry in it if entry.name in names)
+        except OSError:
+            # Never assume missing: that would let restore write over them unchecked
+            existing.update(path for path in (os.path.join(parent, name) for name in names) if os.path.lexists(path))
+            continue
+        if listed_dirs is not None:
+            listed_dirs.add(parent)
+    return existing
+
+def sendfile_all(out_fd, in_fd, offset, count):
+    """Copy count bytes of in_fd starting at offset to out_fd inside the kernel.
+
+    Returns the number of bytes copied, which is short only if in_fd hit EOF.
+    """
+    copied = 0
+    while copied < count:
+        n = os.sendfile(out_fd, in_fd, offset + copied, count - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+class FixedSizeReader:
+    """Reads exactly size bytes from a file that may change while it is read.
+
+    Data past size is left out, and if the file shrank, the missing part is
+    read as NUL bytes (like GNU tar does) so an archive member still gets
+    the size its header declared.
+    """
+
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+        self.padded = 0
+
+    def read(self, n=-1):
+        if n < 0 or n > self.remaining:
+            n = self.remaining
+        data = self.f.read(n) if n else b""
+        if len(data) < n:
+            self.padded += n - len(data)
+            data += bytes(n - len(data))
+        self.remaining -= n
+        return data
+
+def staging_name(name):
+    """Return a fresh hidden name to stage a replacement for name next to it.
+
+    The name is random, so nobody else who can write to the directory can
+    plant something (a symlink to another file, say) at it beforehand.
+    """
+    return f".{name}.{os.urandom(6).hex()}.ragnarok-tmp"
+
+def create_staging(dst):
+    """Create a new, empty staging file next to dst and return (fd, path)."""
+    parent, name = os.path.split(dst)
+    while True:
+        path = os.path.join(parent, staging_name(name))
+        try:
+            # O_EXCL never opens an existing file and never follows a symlink
+            return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o666), path
+        except FileExistsError:
+            continue
+
+def make_parent_dirs(paths, known_dirs=()):
+    """Create the parent directories of paths, each unique directory once, shallowest first.
+
+    Directories in known_dirs already exist and are not touched. Returns the
+    directories that were made sure of.
+    """
+    parents = {os.path.dirname(p) for p in paths}.difference(known_dirs)
+    for d in sorted(parents, key=lambda d: d.count("/")):
+        os.makedirs(d, exist_ok=True)
+    return parents
+
+class ParentDir:
+    """Keeps the parent directory of the last path open, so *at() calls on its
+    siblings skip re-resolving the directory part of every path."""
+
+    def __init__(self):
+        self.path = None
+        self.fd = None
+
+    def at(self, path):
+        """Return (name, dir_fd) to pass to an os call for path; dir_fd is None if
+        the parent can't be opened, and name is path itself then."""
+        parent, name = os.path.split(path)
+        if parent != self.path:
+            self.close()
+            self.path = parent
+            try:
+                self.fd = os.open(parent or ".", getattr(os, "O_PATH", os.O_RDONLY) | os.O_DIRECTORY)
+            except OSError:
+                pass
+        return (name, self.fd) if self.fd is not None else (path, None)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.path = None
+        self.fd = None
+
+# renameat2() flag that swaps two paths atomically (Linux 3.15+)
+RENAME_EXCHANGE = 2
+AT_FDCWD = -100
+
+@functools.lru_cache(maxsize=None)
+def load_renameat2():
+    """Return libc's renameat2 through ctypes, or None where it can't be loaded (glibc < 2.28, not Linux)."""
+    try:
+        import ctypes
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (ImportError, OSError, AttributeError):
+        return None
+    renameat2.restype = ctypes.c_int
+    renameat2.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint)
+    return renameat2
+
+def exchange_paths(a, b, dir_fd=None):
+    """Atomically swap the entries at a and b, relative to dir_fd if given.
+
+    Returns False, with nothing changed, where the system or filesystem can't do it.
+    """
+    renameat2 = load_renameat2()
+    if renameat2 is None:
+        return False
+    import ctypes
+    fd = AT_FDCWD if dir_fd is None else dir_fd
+    if renameat2(fd, os.fsencode(a), fd, os.fsencode(b), RENAME_EXCHANGE) == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+        return False
+    raise OSError(err, os.strerror(err), b)
+
+# Default and allowed --compress-level per compression method
+COMPRESS_LEVELS = {"zstd": (3, 1, 19), "gz": (6, 1, 9), "lz4": (1, 1, 12)}
+
+class BackupArchive:
+    """Archive that backup entries are streamed into directly, without a staging copy."""
+
+    def __init__(self, output, compress, level=None):
+        self.output = output
+        self.tar = None
+        self.zip = None
+        self.proc = None
+        self.out_f = None
+        self.zwriter = None
+        # Uncompressed tar goes to a plain file, so file data can bypass userspace
+        self.direct = compress == "none"
+        zstandard = load_zstandard() if compress == "zstd" else None
+        lz4frame = load_lz4() if compress == "lz4" else None
+        if level is None and compress in COMPRESS_LEVELS:
+            level = COMPRESS_LEVELS[compress][0]
+        if compress == "zip":
+            self.zip = zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED)
+        elif zstandard is not None:
+            # In-process multithreaded zstd, no extra process or pipe
+            cctx = zstandard.ZstdCompressor(level=level, threads=-1)
+            self.out_f = open(output, "wb")
+            self.zwriter = cctx.stream_writer(self.out_f)
+            self.tar = tarfile.open(fileobj=self.zwriter, mode="w|", bufsize=COPY_BUFSIZE, copybufsize=COPY_BUFSIZE)
+        elif compress == "zstd":
+            # Multithreaded zstd reads the tar stream from a pipe
+            self.proc = subprocess.Popen(["zstd", f"-{level}", "-T0", "-q", "-o", str(output)], stdin=subprocess.PIPE)
+            self.tar = tarfile.open(fileobj=self.proc.stdin, mode="w|", bufsize=COPY_BUFSIZE, copybufsize=COPY_BUFSIZE)
+        elif lz4frame is not None:
+            # The frame file opens and closes the output itself
+            self.zwriter = lz4frame.open(output, "wb", compression_level=level)
+            self.tar = tarfile.open(fileobj=self.zwriter, mode="w|", bufsize=COPY_BUFSIZE, copybufsize=COPY_BUFSIZE)
+        elif compress == "lz4":
+            self.out_f = open(output, "wb")
+            self.proc = subprocess.Popen(["lz4", f"-{level}", "-q", "-c"], stdin=subprocess.PIPE, stdout=self.out_f)
+            self.tar = tarfile.open(fileobj=self.proc.stdin, mode="w|", bufsize=COPY_BUFSIZE, copybufsize=COPY_BUFSIZE)
+        elif compress == "gz" and shutil.which("pigz"):
+            self.out_f = open(output, "wb")
+            self.proc = subprocess.Popen(["pigz", f"-{level}", "-p", str(os.cpu_count() or 1), "-c"], stdin=subprocess.PIPE, stdout=self.out_f)
+            self.tar = tarfile.open(fileobj=self.proc.stdin, mode="w|", bufsize=COPY_BUFSIZE, copybufsize=COPY_BUFSIZE)
+        elif compress == "gz":
+            self.tar = tarfile.open(output, "w:gz", compresslevel=level, copybufsize=COPY_BUFSIZE)
+        else:
+            self.tar = tarfile.open(output, "w", copybufsize=COPY_BUFSIZE)
+
+    def _tarinfo(self, arcname, st, type):
+        info = tarfile.TarInfo(arcname)
+        info.type = type
+        if st is None:
+            # Synthetic member (dry run or marker), nothing on disk was looked at
+            info.mode = {tarfile.DIRTYPE: 0o755, tarfile.SYMTYPE: 0o777}.get(type, 0o644)
+            info.mtime = int(time.time())
+            return info
+        info.mode = stat.S_IMODE(st.st_mode)
+        info.uid = st.st_uid
+        info.gid = st.st_gid
+        info.mtime = st.st_mtime
+        return info
+
+    def _zipinfo(self, arcname, st):
+        if st is None:
+            info = zipfile.ZipInfo(arcname, time.localtime()[:6])
+            info.external_attr = (stat.S_IFREG | 0o644) << 16
+        else:
+            info = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[:6])
+            info.external_attr = (st.st_mode & 0xFFFF) << 16
+        info.compress_type = zipfile.ZIP_DEFLATED
+        return info
+
+    def add_file(self, arcname, st, data=None, fileobj=None):
+        """Add a regular file from in-memory data or an open file; neither means empty.
+
+        An open file is archived with its st_size. Returns how many NUL bytes
+        stood in for data the file lost while it was being archived.
+        """
+        if self.zip is not None:
+            info = self._zipinfo(arcname, st)
+            if fileobj is not None:
+                info.file_size = st.st_size
+                src = FixedSizeReader(fileobj, st.st_size)
+                with self.zip.open(info, "w") as dst:
+                    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+                return src.padded
+            self.zip.writestr(info, data or b"")
+            return 0
+        info = self._tarinfo(arcname, st, tarfile.REGTYPE)
+        if fileobj is not None and self.direct:
+            info.size = st.st_size
+            return self._sendfile_member(info, fileobj)
+        if fileobj is not None:
+            info.size = st.st_size
+            src = FixedSizeReader(fileobj, st.st_size)
+            self.tar.addfile(info, src)
+            return src.padded
+        info.size = len(data or b"")
+        self.tar.addfile(info, io.BytesIO(data) if data else None)
+        return 0
+
+    def _sendfile_member(self, info, fileobj):
+        """Like TarFile.addfile, but the data is copied with sendfile(2).
+
+        Returns how many NUL bytes were padded in for data the file lost meanwhile.
+        """
+        tar = self.tar
+        header = info.tobuf(tar.format, tar.encoding, tar.errors)
+        tar.fileobj.write(header)
+        tar.offset += len(header)
+        tar.fileobj.flush()
+        padded = info.size - sendfile_all(tar.fileobj.fileno(), fileobj.fileno(), 0, info.size)
+        for start in range(0, padded, COPY_BUFSIZE):
+            tar.fileobj.write(bytes(min(COPY_BUFSIZE, padded - start)))
+        blocks, remainder = divmod(info.size, tarfile.BLOCKSIZE)
+        if remainder:
+            tar.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        tar.offset += blocks * tarfile.BLOCKSIZE
+        tar.members.append(info)
+        return padded
+
+    def add_symlink(self, arcname, st, target):
+        """Add a symlink; zip has no symlinks, so an empty placeholder is stored."""
+        if self.zip is not None:
+            self.zip.writestr(self._zipinfo(arcname, st), b"")
+            return
+        info = self._tarinfo(arcname, st, tarfile.SYMTYPE)
+        info.linkname = target
+        self.tar.addfile(info)
+
+    def add_dir(self, arcname, st=None):
+        """Add a directory entry; without st it gets default metadata (directory symlink markers, dry run)."""
+        if self.zip is not None:
+            self.zip.writestr(arcname.rstrip("/") + "/", b"")
+            return
+        self.tar.addfile(self._tarinfo(arcname, st, tarfile.DIRTYPE))
+
+    def add_bytes(self, arcname, data):
+        """Add an in-memory file such as links.json."""
+        if self.zip is not None:
+            self.zip.writestr(arcname, data)
+            return
+        info = tarfile.TarInfo(arcname)
+        info.size = len(data)
+        info.mode = 0o644
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+            return
+        self.tar.close()
+        if self.zwriter is not None:
+            # Also closes out_f
+            self.zwriter.close()
+        if self.proc is not None:
+            self.proc.stdin.close()
+            returncode = self.proc.wait()
+            if self.out_f is not None:
+                self.out_f.close()
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, self.proc.args)
+
+    def abort(self):
+        """Give up on a failed backup: release everything without finalizing, and delete the output."""
+        try:
+            if self.zip is not None:
+                # Without its file, close() has nowhere to write the central directory
+                fp, self.zip.fp = self.zip.fp, None
+                if fp is not None:
+                    fp.close()
+                return
+            if self.proc is not None:
+                self.proc.kill()
+                self.proc.wait()
+            # Marked closed, tar never writes its end-of-archive blocks
+            self.tar.closed = True
+            for f in (self.tar.fileobj, self.zwriter, self.proc and self.proc.stdin, self.out_f):
+                if f is None:
+                    continue
+                try:
+                    f.close()
+                except Exception:
+                    # Flushing into a killed compressor, the data is dropped anyway
+                    pass
+        finally:
+            try:
+                os.unlink(self.output)
+            except FileNotFoundError:
+                pass
+
+# Archive members under these folders are restored to their original paths,
+# everything else (affiliation.tsv, metadata/, ...) is backup bookkeeping
+PAYLOAD_DIRS = ("home_dirs/", "files/")
+
+class RestoreArchive:
+    """Reads a backup archive member by member, without extracting it to disk first."""
+
+    def __init__(self, path, suffix):
+        self.path = path
+        self.suffix = suffix
+        self.tar = None
+        self.zip = None
+        self.f = None
+        self.map = None
+        self.proc = None
+        # Set once members() has read to the end, so close() knows the decoder finished
+        self.done = False
+        # Set when the tar is a plain file on disk, so members can be sendfile()d out
+        self.direct = False
+
+    def open(self):
+        """Start a new pass over the archive."""
+        self.done = False
+        if self.suffix == ".zip":
+            self.zip = zipfile.ZipFile(self.path, "r")
+        elif self.suffix == ".tar":
+            # Headers are parsed straight out of the page cache rather than
+            # through a seek() and read() per member
+            self.f = open(self.path, "rb")
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+            self.tar = tarfile.open(fileobj=self.map, mode="r:", copybufsize=COPY_BUFSIZE)
+            self.direct = True
+        elif self.suffix == ".tar.gz" and shutil.which("pigz"):
+            # Decompression runs in its own process, overlapped with extraction
+            self._open_pipe(["pigz", "-d", "-c", str(self.path)])
+        elif self.suffix == ".tar.gz":
+            self.tar = tarfile.open(self.path, "r|gz", bufsize=COPY_BUFSIZE)
+        elif self.suffix == ".tar.zst":
+            zstandard = load_zstandard()
+            if zstandard is not None:
+                self.f = open(self.path, "rb")
+                reader = zstandard.ZstdDecompressor().stream_reader(self.f, read_across_frames=True)
+                self.tar = tarfile.open(fileobj=reader, mode="r|", bufsize=COPY_BUFSIZE)
+            else:
+                self._open_pipe(["zstd", "-d", "-c", "-T0", str(self.path)])
+        elif self.suffix == ".tar.lz4":
+            lz4frame = load_lz4()
+            if lz4frame is not None:
+                self.f = lz4frame.open(self.path, "rb")
+                self.tar = tarfile.open(fileobj=self.f, mode="r|", bufsize=COPY_BUFSIZE)
+            else:
+                self._open_pipe(["lz4", "-d", "-c", str(self.path)])
+
+    def _open_pipe(self, cmd):
+        """Read the tar stream from the stdout of a decompressor command."""
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        self.tar = tarfile.open(fileobj=self.proc.stdout, mode="r|", bufsize=COPY_BUFSIZE)
+
+    def close(self):
+        if self.zip is not None:
+            self.zip.close()
+            self.zip = None
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if self.proc is not None:
+            proc, self.proc = self.proc, None
+            if not self.done:
+                # Pass stopped early; the decoder would only die of SIGPIPE
+                proc.kill()
+            proc.stdout.close()
+            if proc.wait() != 0 and self.done:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+    def members(self):
+        """Yield (name, member) in archive order, with names matching affiliation keys."""
+        if self.zip is not None:
+            for info in self.zip.infolist():
+                yield info.filename.rstrip("/"), info
+            self.done = True
+            return
+        for info in self.tar:
+            # Archives made with shutil.make_archive store "./files/..."
+            name = info.name[2:] if info.name.startswith("./") else info.name
+            yield name, info
+        self.done = True
+
+    def is_file(self, member):
+        if self.zip is not None:
+            return not member.is_dir()
+        return member.isreg()
+
+    def is_dir(self, member):
+        if self.zip is not None:
+            return member.is_dir()
+        return member.isdir()
+
+    def size(self, member):
+        return member.file_size if self.zip is not None else member.size
+
+    def read(self, member):
+        """Return the contents of a regular file member."""
+        if self.can_extract_concurrently(member):
+            # Slicing leaves the map's position alone, so this is safe off-thread too
+            data = self.map[member.offset_data:member.offset_data + member.size]
+            if len(data) != member.size:
+                raise tarfile.ReadError("unexpected end of data")
+            return data
+        src = self.zip.open(member) if self.zip is not None else self.tar.extractfile(member)
+        with src:
+            return src.read()
+
+    def can_extract_concurrently(self, member):
+        # sendfile() with an explicit offset, like slicing the map, leaves the
+        # shared file position alone
+        return self.direct and member.isreg() and not member.issparse()
+
+    def extract(self, member, dest, data=None):
+        """Write a regular file member to dest, keeping the archived mode and mtime.
+
+        dest is a path or a descriptor open for writing, which is closed afterwards.
+        data, if given, is the member's contents as returned by read().
+        """
+        with open(dest, "wb") as dst:
+            if data is not None:
+                dst.write(data)
+            elif self.direct and member.isreg() and not member.issparse():
+                copied = sendfile_all(dst.fileno(), self.f.fileno(), member.offset_data, member.size)
+                if copied != member.size:
+                    raise tarfile.ReadError("unexpected end of data")
+            else:
+                src = self.zip.open(member) if self.zip is not None else self.tar.extractfile(member)
+                with src:
+                    shutil.copyfileobj(src, dst, COPY_BUFSIZE)
+            if self.tar is not None:
+                # Through the open descriptor, so the path isn't resolved twice more
+                dst.flush()
+                os.fchmod(dst.fileno(), member.mode)
+                os.utime(dst.fileno(), (member.mtime, member.mtime))
+
+# Prefixes of the paths that go under home_dirs/ regardless of the current user
+HOME_ROOTS = ("/root/", "/home/")
+
+def get_archive_path(src, home):
+    """Map an absolute, normalized source path to (archive path, top folder).
+
+    Works on plain strings; home is the user's home directory with a trailing slash.
+    """
+    if src.startswith(HOME_ROOTS) or src == "/root":
+        # Handle /root
+        if src[1] == "r":
+            return "home_dirs/root" + src[5:], "home_dirs"
+        # Handle /home/<username>
+        if src[6:7] not in ("", "/"):
+            return "home_dirs/" + src[6:], "home_dirs"
     # Handle current user's home (for non-root users)
-    elif str(src).startswith(str(home)):
-        rel = src.relative_to(home)
-        username = home.name
-        return f"home_dirs/{username}/{rel}", "home_dirs"
+    elif src.startswith(home) or src + "/" == home:
+        username = home.rstrip("/").rsplit("/", 1)[-1]
+        return f"home_dirs/{username}/{src[len(home):]}".rstrip("/"), "home_dirs"
     # Everything else
-    rel = src.relative_to("/")
-    return f"files/{rel}", "files"
+    return "files" + src, "files"
+
+def dump_affiliation(affiliation):
+    """Serialize the archive path -> source path map, returning (archive name, data).
+
+    One "archive_path<TAB>src_path" line per entry, which is far smaller and faster to
+    parse than indented JSON. Paths containing a tab or newline fall back to JSON.
+    """
+    if any("\t" in k or "\n" in k or "\t" in v or "\n" in v for k, v in affiliation.items()):
+        return "affiliation.json", json.dumps(affiliation).encode()
+    text = "".join(f"{k}\t{v}\n" for k, v in affiliation.items())
+    # Non-UTF-8 file names survive as surrogate escapes, like os.fsencode() does
+    return "affiliation.tsv", text.encode("utf-8", "surrogateescape")
+
+# permissions.bin: a header, a table of user/group names (length-prefixed),
+# then one fixed-width record per entry followed by its archive path
+PERM_MAGIC = b"RBP1"
+PERM_HEADER = struct.Struct("<4sII")  # magic, name count, record count
+PERM_RECORD = struct.Struct("<HIIIHH")  # path length, mode, uid, gid, user index, group index
+PERM_NO_NAME = 0xFFFF
+
+def dump_permissions(permissions):
+    """Serialize the archive path -> permission record map, returning (archive name, data).
+
+    Falls back to JSON for the rare path or name too long for the packed format.
+    """
+    names = {}
+    records = []
+    try:
+        for arcname, perm in permissions.items():
+            path = arcname.encode("utf-8", "surrogateescape")
+            user, group = perm.get("user"), perm.get("group")
+            user_idx = PERM_NO_NAME if user is None else names.setdefault(user, len(names))
+            group_idx = PERM_NO_NAME if group is None else names.setdefault(group, len(names))
+            records.append(PERM_RECORD.pack(len(path), perm["mode"], perm["uid"], perm["gid"], user_idx, group_idx))
+            records.append(path)
+        if len(names) >= PERM_NO_NAME:
+            raise struct.error("too many names")
+        table = [bytes([len(n)]) + n for n in (name.encode("utf-8", "surrogateescape") for name in names)]
+    except (struct.error, ValueError):
+        return "permissions.json", dump_json(permissions)
+    return "permissions.bin", b"".join([PERM_HEADER.pack(PERM_MAGIC, len(names), len(permissions)), *table, *records])
+
+def iter_permissions(index_dir):
+    """Yield (archive path, mode, uid, gid, user, group) from permissions.bin or the older permissions.json.
 
-def collect_installed_packages(metadata_dir):
+    user and group are None when the backup has no name for them.
+    """
+    bin_path = index_dir / "permissions.bin"
+    if bin_path.exists():
+        with open(bin_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, name_count, count = PERM_HEADER.unpack_from(data, 0)
+            if magic != PERM_MAGIC:
+                raise ValueError(f"{bin_path} is not a permissions index")
+            pos = PERM_HEADER.size
+            names = []
+            for _ in range(name_count):
+                end = pos + 1 + data[pos]
+                names.append(data[pos + 1:end].decode("utf-8", "surrogateescape"))
+                pos = end
+            names.append(None)
+            unpack = PERM_RECORD.unpack_from
+            for _ in range(count):
+                path_len, mode, uid, gid, user_idx, group_idx = unpack(data, pos)
+                pos += PERM_RECORD.size
+                path = data[pos:pos + path_len].decode("utf-8", "surrogateescape")
+                pos += path_len
+                yield path, mode, uid, gid, names[min(user_idx, name_count)], names[min(group_idx, name_count)]
+        return
+    for path, perm in iter_json_items(index_dir / "permissions.json"):
+        yield path, perm["mode"], perm["uid"], perm["gid"], perm.get("user"), perm.get("group")
+
+def load_affiliation(index_dir):
+    """Read affiliation.tsv or the older affiliation.json from index_dir, None if neither exists."""
+    tsv_path = index_dir / "affiliation.tsv"
+    if tsv_path.exists():
+        # Decoded in one go rather than line by line through a text wrapper;
+        # the only line break the format allows is "\n"
+        with open(tsv_path, "rb") as f:
+            text = f.read().decode("utf-8", "surrogateescape")
+        return dict(line.split("\t", 1) for line in text.split("\n") if line)
+    json_path = index_dir / "affiliation.json"
+    if json_path.exists():
+        return load_json(json_path)
+    return None
+
+def archive_suffix(path):
+    return "".join(Path(path).suffixes)
+
+def load_incremental_base(base_path):
+    """Return (sizes, holders) from a previous backup's index.
+
+    sizes maps archive paths to [size, mtime_ns]; holders maps the files that
+    backup itself skipped to the name of the backup holding their data.
+    """
+    index = {}
+    archive = RestoreArchive(base_path, archive_suffix(base_path))
+    archive.open()
     try:
-        # Get manually installed packages
-        manual = subprocess.check_output(
-            "comm -23 <(apt-mark showmanual | sort) <(apt-mark showauto | sort)",
-            shell=True, executable="/bin/bash"
-        ).decode().splitlines()
+        for name, member in archive.members():
+            # The index of backups that carry sizes_mtimes.json precedes their payload
+            if name.startswith(PAYLOAD_DIRS):
+                break
+            if name in ("sizes_mtimes.json", "unchanged.json"):
+                index[name] = parse_json(archive.read(member))
+    finally:
+        archive.close()
+    if "sizes_mtimes.json" not in index:
+        return None, None
+    return index["sizes_mtimes.json"], index.get("unchanged.json", {})
+
+def collect_installed_packages():
+    try:
+        # Get manually installed packages; both apt-mark queries run side by side
+        procs = [subprocess.Popen(["apt-mark", which], stdout=subprocess.PIPE)
+                 for which in ("showmanual", "showauto")]
+        manual, auto = (set(proc.communicate()[0].decode().split()) for proc in procs)
+        for proc in procs:
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        manual -= auto
         if not manual:
             raise Exception("No manual packages found or not a Debian-based system.")
 
-        # Get versions for those packages
-        dpkg_cmd = f"dpkg -l | grep -E '^ii' | grep -Ff <(printf '%s\n' {' '.join(manual)})"
-        versions = subprocess.check_output(
-            dpkg_cmd,
-            shell=True, executable="/bin/bash"
-        ).decode()
-        (metadata_dir / "installed_packages.txt").write_text(versions)
-    except Exception as e:
-        (metadata_dir / "installed_packages.txt").write_text(
-            f"# Could not collect installed packages: {e}\n"
+        # Get versions for those packages in one dpkg-query, in dpkg -l's "ii pkg ver" shape
+        result = subprocess.run(
+            ["dpkg-query", "-W", "-f=${db:Status-Abbrev} ${binary:Package} ${Version}\n", *sorted(manual)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        versions = "".join(
+            line + "\n" for line in result.stdout.decode().splitlines() if line.startswith("ii ")
         )
+        return versions
+    except Exception as e:
+        return f"# Could not collect installed packages: {e}\n"
 
-def collect_apt_repos(metadata_dir):
+def build_apt_repos():
+    """Concatenate sources.list and sources.list.d/*.list, as stored in metadata/apt_repos.txt."""
+    parts = []
+    try:
+        parts.append("### /etc/apt/sources.list\n" + Path("/etc/apt/sources.list").read_text() + "\n")
+    except FileNotFoundError:
+        pass
+    parts.append("### /etc/apt/sources.list.d/\n")
     try:
-        sources = ""
-        if Path("/etc/apt/sources.list").exists():
-            sources += "### /etc/apt/sources.list\n"
-            sources += Path("/etc/apt/sources.list").read_text() + "\n"
-        sources += "### /etc/apt/sources.list.d/\n"
-        sources_list_d = Path("/etc/apt/sources.list.d")
-        if sources_list_d.exists():
-            for f in sorted(sources_list_d.glob("*.list")):
-                sources += f"## {f}\n"
-                sources += f.read_text() + "\n"
-        (metadata_dir / "apt_repos.txt").write_text(sources)
+        with os.scandir("/etc/apt/sources.list.d") as it:
+            lists = sorted((e.name, e.path) for e in it if e.name.endswith(".list"))
+    except FileNotFoundError:
+        lists = []
+    for _, path in lists:
+        parts.append(f"## {path}\n" + Path(path).read_text() + "\n")
+    return "".join(parts)
+
+def collect_apt_repos():
+    try:
+        return build_apt_repos()
     except Exception as e:
-        (metadata_dir / "apt_repos.txt").write_text(
-            f"# Could not collect apt repositories: {e}\n"
-        )
+        return f"# Could not collect apt repositories: {e}\n"
 
 def backup(args):
     home = Path.home()
+    home_prefix = os.path.join(str(home), "")
     backup_dir = home / "ragnarokbackup"
     backups_dir = backup_dir / "backups"
     list_file = backup_dir / ".ragnarokbackup"
+    # Options read in per-entry loops are kept in locals
     verbose = args.verbose
+    dry_run = args.dry_run
 
-    # Zstd check
+    # Zstd/lz4 check
     if args.compress == "zstd":
         check_zstd()
+    elif args.compress == "lz4":
+        check_lz4()
+    elif args.compress == "gz" and sys.stdout.isatty():
+        cprint("Tip: --compress zstd is usually both faster and smaller than gz.", Colors.OKCYAN)
+
+    if args.compress_level is not None:
+        if args.compress not in COMPRESS_LEVELS:
+            cprint(f"--compress-level has no effect with --compress {args.compress}.", Colors.WARNING)
+        else:
+            _, low, high = COMPRESS_LEVELS[args.compress]
+            if not low <= args.compress_level <= high:
+                cprint(f"ERROR: --compress-level for {args.compress} must be between {low} and {high}.", Colors.FAIL)
+                sys.exit(1)
 
     # Console info
-    if args.dry_run:
+    if dry_run:
         cprint("Running backup in dry-run mode: all files in the archive will be empty.", Colors.OKCYAN)
     else:
         cprint("Running real backup: files will be copied with data.", Colors.OKGREEN)
@@ -129,225 +992,266 @@ def backup(args):
         cprint("No files or folders listed in .ragnarokbackup. Nothing to back up.", Colors.WARNING)
         return
 
-    # Create temp dir for backup structure
-    with tempfile.TemporaryDirectory() as tempdir:
-        tempdir = Path(tempdir)
-        metadata_dir = tempdir / "metadata"
-        (metadata_dir).mkdir()
-        (tempdir / "home_dirs").mkdir()
-        (tempdir / "files").mkdir()
-        affiliation = {}
-        permissions = {}  # NEW: store permissions
-        links = {}  # NEW: store symbolic links
+    # Determine output archive path and compression
+    from datetime import datetime
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    ext = {
+        "none": ".tar",
+        "gz": ".tar.gz",
+        "zstd": ".tar.zst",
+        "lz4": ".tar.lz4",
+        "zip": ".zip"
+    }[args.compress]
 
-        # --- METADATA COLLECTION ---
-        cprint("Collecting system metadata...", Colors.OKBLUE)
-        collect_installed_packages(metadata_dir)
-        collect_apt_repos(metadata_dir)
-        cprint("Created metadata files.", Colors.OKGREEN)
+    if args.output:
+        output_dir = Path(args.output)
+        if not output_dir.exists():
+            output_dir.mkdir(parents=True)
+    else:
+        output_dir = backups_dir
 
-        for path in paths:
-            src = Path(path)
-            if not src.is_absolute():
-                cprint(f"Skipping non-absolute path: {path}", Colors.WARNING)
-                continue
-            if not src.exists():
-                cprint(f"Skipping missing path: {path}", Colors.WARNING)
-                continue
+    output = output_dir / f"backup_{ts}{ext}"
 
-            # Determine archive path
-            archive_path, top_folder = get_archive_path(src, home)
-            dest = tempdir / archive_path
+    # Files whose size and mtime match the base backup are left out and
+    # recorded in unchanged.json instead
+    base_sizes, base_holders, base_name = {}, {}, None
+    if args.incremental_base and not dry_run:
+        base = Path(args.incremental_base)
+        base_name = base.name
+        if archive_suffix(base) not in ARCHIVE_SUFFIXES or not base.is_file():
+            cprint(f"Incremental base is not a backup archive: {base}", Colors.FAIL)
+            sys.exit(1)
+        check_decompressor(archive_suffix(base))
+        base_sizes, base_holders = load_incremental_base(base)
+        if base_sizes is None:
+            cprint(f"{base} has no sizes_mtimes.json and can't be used as an incremental base.", Colors.FAIL)
+            sys.exit(1)
+        cprint(f"Incremental backup against {base.name} ({len(base_sizes)} files)", Colors.OKBLUE)
 
-            if src.is_file():
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                if args.dry_run:
-                    dest.touch()
-                else:
-                    shutil.copy2(src, dest)
-                affiliation[str(dest.relative_to(tempdir))] = str(src)
-                # NEW: record permissions
-                st = src.stat()
-                permissions[str(dest.relative_to(tempdir))] = {
-                    "mode": st.st_mode,
-                    "uid": st.st_uid,
-                    "gid": st.st_gid,
-                    "user": pwd.getpwuid(st.st_uid).pw_name, # NEW
-                    "group": grp.getgrgid(st.st_gid).gr_name # NEW
-                }
-                if verbose:
-                    cprint(f"Added file: {src} -> {dest} (empty: {args.dry_run})", Colors.OKCYAN)
-            # NEW: Handle symbolic links
-            elif src.is_symlink():
-                target = os.readlink(src)
-                dest.parent.mkdir(parents=True, exist_ok=True)
-                if args.dry_run:
-                    dest.touch()
+    affiliation = {}
+    links = {}  # NEW: store symbolic links
+
+    # Walk everything before the output archive exists, so a listed directory
+    # that holds it can't pick up the half-written archive. The pool then
+    # opens/stats/reads entries ahead of the (strictly sequential) archive writer.
+    def link_info(src, is_dir=False):
+        target = os.readlink(src)
+        info = {
+            "target": target,
+            "is_absolute": os.path.isabs(target)
+        }
+        if is_dir:
+            info["is_dir"] = True
+        return info
+
+    def walk_path(path):
+        """Return the (kind, src, arcname) entries, link infos, file [size, mtime_ns] and warnings for one listed path."""
+        entries = []
+        links = {}
+        sizes = {}
+        warnings = []
+        src = Path(path)
+        src_str = str(src)
+        if not src.is_absolute():
+            warnings.append(f"Skipping non-absolute path: {path}")
+            return entries, links, sizes, warnings
+        # One lstat() dispatches on the type; only symlinks need a second
+        # stat() to see what they point to
+        try:
+            st = os.lstat(src_str)
+        except (FileNotFoundError, NotADirectoryError):
+            st = None
+        is_link = st is not None and stat.S_ISLNK(st.st_mode)
+        if is_link:
+            st = try_stat(src_str)
+        if st is None:
+            warnings.append(f"Skipping missing path: {path}")
+            return entries, links, sizes, warnings
+
+        # Determine archive path
+        archive_path, top_folder = get_archive_path(src_str, home_prefix)
+
+        # A listed symlink to a file is backed up as that file
+        if stat.S_ISREG(st.st_mode):
+            entries.append(("file", src_str, archive_path))
+            if not dry_run:
+                sizes[archive_path] = [st.st_size, st.st_mtime_ns]
+        # NEW: Handle symbolic links
+        elif is_link:
+            entries.append(("link", src_str, archive_path))
+            links[archive_path] = link_info(src_str)
+        elif stat.S_ISDIR(st.st_mode):
+            # Entry paths all start with the scanned directory, so their
+            # archive names are built by slicing instead of Path arithmetic
+            skip = len(os.path.join(src_str, ""))
+            dest_prefix = os.path.join(archive_path, "")
+            for entry in scan_tree(src_str, warnings):
+                dest = dest_prefix + entry.path[skip:]
+                if entry.is_symlink():
+                    # Symlinks to directories are recorded but never descended into
+                    if entry.is_dir():
+                        entries.append(("dirlink", entry.path, dest))
+                        links[dest] = link_info(entry.path, is_dir=True)
+                    else:
+                        entries.append(("link", entry.path, dest))
+                        links[dest] = link_info(entry.path)
+                elif entry.is_dir(follow_symlinks=False):
+                    entries.append(("dir", entry.path, dest))
+                elif entry.is_file(follow_symlinks=False):
+                    entries.append(("file", entry.path, dest))
+                    if not dry_run:
+                        try:
+                            est = entry.stat(follow_symlinks=False)
+                            sizes[dest] = [est.st_size, est.st_mtime_ns]
+                        except FileNotFoundError:
+                            pass
                 else:
-                    # Store the content of the link target as a regular file
-                    try:
-                        shutil.copy2(src, dest, follow_symlinks=False)
-                    except (shutil.SameFileError, OSError):
-                        # If copy fails, just create an empty file
-                        dest.touch()
-                affiliation[str(dest.relative_to(tempdir))] = str(src)
-                # Record link information
-                links[str(dest.relative_to(tempdir))] = {
-                    "target": target,
-                    "is_absolute": Path(target).is_absolute()
-                }
-                if verbose:
-                    cprint(f"Added symlink: {src} -> {target} (archived as regular file)", Colors.OKCYAN)
-            elif src.is_dir():
-                for root, dirs, files in os.walk(src, followlinks=False):
-                    rel_root = Path(root).relative_to(src)
-                    for d in dirs:
-                        dir_path = Path(root) / d
-                        # Check if directory is a symlink before processing it as a directory
-                        if dir_path.is_symlink():
-                            symlink_archive_path, _ = get_archive_path(dir_path, home)
-                            symlink_dest = tempdir / symlink_archive_path
-                            symlink_dest.parent.mkdir(parents=True, exist_ok=True)
-                            
-                            # Handle directory symlink
-                            target = os.readlink(dir_path)
-                            if args.dry_run:
-                                symlink_dest.touch()
-                            else:
-                                # Create a marker file for directory symlinks
-                                symlink_dest.mkdir(parents=True, exist_ok=True)
-                            
-                            # Record in affiliation and links
-                            affiliation[str(symlink_dest.relative_to(tempdir))] = str(dir_path)
-                            links[str(symlink_dest.relative_to(tempdir))] = {
-                                "target": target,
-                                "is_absolute": Path(target).is_absolute(),
-                                "is_dir": True
-                            }
-                            if verbose:
-                                cprint(f"Added directory symlink: {dir_path} -> {target}", Colors.OKCYAN)
-                        else:
-                            # Regular directory
-                            dest_dir = dest / rel_root / d
-                            dest_dir.mkdir(parents=True, exist_ok=True)
-                            # Record permissions for directories
-                            st = dir_path.stat()
-                            permissions[str(dest_dir.relative_to(tempdir))] = {
-                                "mode": st.st_mode,
-                                "uid": st.st_uid,
-                                "gid": st.st_gid,
-                                "user": pwd.getpwuid(st.st_uid).pw_name, # NEW
-                                "group": grp.getgrgid(st.st_gid).gr_name # NEW
-                            }
-                    
-                    for file in files:
-                        src_file = Path(root) / file
-                        # Check if file is a symlink
-                        if src_file.is_symlink():
-                            dest_file = dest / rel_root / file
-                            dest_file.parent.mkdir(parents=True, exist_ok=True)
-                            
-                            target = os.readlink(src_file)
-                            if args.dry_run:
-                                dest_file.touch()
-                            else:
-                                try:
-                                    # Store the content as a regular file
-                                    shutil.copy2(src_file, dest_file, follow_symlinks=False)
-                                except (shutil.SameFileError, OSError):
-                                    # If copy fails, just create an empty file
-                                    dest_file.touch()
-                                    
-                            affiliation[str(dest_file.relative_to(tempdir))] = str(src_file)
-                            links[str(dest_file.relative_to(tempdir))] = {
-                                "target": target,
-                                "is_absolute": Path(target).is_absolute()
-                            }
-                            if verbose:
-                                cprint(f"Added symlink: {src_file} -> {target} (archived as regular file)", Colors.OKCYAN)
-                        else:
-                            # Regular file
-                            dest_file = dest / rel_root / file
-                            dest_file.parent.mkdir(parents=True, exist_ok=True)
-                            if args.dry_run:
-                                dest_file.touch()
-                            else:
-                                shutil.copy2(src_file, dest_file)
-                            
-                            affiliation[str(dest_file.relative_to(tempdir))] = str(src_file)
-                            # Record permissions for files
-                            st = src_file.stat()
-                            permissions[str(dest_file.relative_to(tempdir))] = {
-                                "mode": st.st_mode,
-                                "uid": st.st_uid,
-                                "gid": st.st_gid,
-                                "user": pwd.getpwuid(st.st_uid).pw_name, # NEW
-                                "group": grp.getgrgid(st.st_gid).gr_name # NEW
-                            }
-                            if verbose:
-                                cprint(f"Added file: {src_file} -> {dest_file} (empty: {args.dry_run})", Colors.OKCYAN)
-            else:
-                cprint(f"Skipping unknown path type: {path}", Colors.WARNING)
+                    # FIFOs, sockets and devices: opening one for reading could
+                    # block forever or never reach EOF
+                    warnings.append(f"Skipping special file: {entry.path}")
+        else:
+            warnings.append(f"Skipping unknown path type: {path}")
+        return entries, links, sizes, warnings
+
+    # Listed paths are walked concurrently (scandir and readlink release the
+    # GIL), their results and warnings are merged in list order
+    entries = []
+    sizes = {}
+    with ThreadPoolExecutor(max_workers=args.jobs) as walkers:
+        for path_entries, path_links, path_sizes, path_warnings in walkers.map(walk_path, paths):
+            for warning in path_warnings:
+                cprint(warning, Colors.WARNING)
+            entries.extend(path_entries)
+            links.update(path_links)
+            sizes.update(path_sizes)
+    affiliation.update((arcname, src) for kind, src, arcname in entries if kind != "dir")
+    # Data of unchanged files lives in the base backup, or in whichever
+    # backup the base itself took it from
+    unchanged = {
+        arcname: base_holders.get(arcname, base_name)
+        for arcname, size_mtime in sizes.items()
+        if base_sizes.get(arcname) == size_mtime
+    }
+
+    cprint(f"Creating archive at: {output}", Colors.HEADER)
+
+    # Files are streamed into the archive as they are found, no staging copy.
+    # It only gets its final name once it is complete, so a backup that was
+    # killed halfway never looks like a usable (incremental base) archive.
+    partial = output.with_name(output.name + ".partial")
+    archive = BackupArchive(partial, args.compress, args.compress_level)
+    try:
+        permissions = {}  # NEW: store permissions
+
+        # --- METADATA COLLECTION ---
+        cprint("Collecting system metadata...", Colors.OKBLUE)
+        if dry_run:
+            # Structure only, empty placeholders
+            archive.add_bytes("metadata/installed_packages.txt", b"")
+            archive.add_bytes("metadata/apt_repos.txt", b"")
+        else:
+            archive.add_bytes("metadata/installed_packages.txt", collect_installed_packages().encode())
+            apt_repos = collect_apt_repos().encode()
+            archive.add_bytes("metadata/apt_repos.txt", apt_repos)
+            # Lets restore compare against the running system without reading the copy
+            archive.add_bytes("metadata/apt_repos.sha256", hashlib.sha256(apt_repos).hexdigest().encode())
+        cprint("Created metadata files.", Colors.OKGREEN)
 
-        # Write affiliation.json
-        aff_path = tempdir / "affiliation.json"
-        with open(aff_path, "w") as f:
-            json.dump(affiliation, f, indent=2)
-        cprint(f"Created affiliation.json with {len(affiliation)} entries.", Colors.OKGREEN)
+        # The index goes in front of the payload so restore can stream the
+        # archive in a single pass
+        affil_name, affil_data = dump_affiliation(affiliation)
+        archive.add_bytes(affil_name, affil_data)
+        cprint(f"Created {affil_name} with {len(affiliation)} entries.", Colors.OKGREEN)
 
-        # Write permissions.json
-        perm_path = tempdir / "permissions.json"
-        with open(perm_path, "w") as f:
-            json.dump(permissions, f, indent=2)
-        cprint(f"Created permissions.json with {len(permissions)} entries.", Colors.OKGREEN)
+        # Sizes and mtimes let a later --incremental-base backup skip unchanged files
+        archive.add_bytes("sizes_mtimes.json", dump_json(sizes))
+        if base_name is not None:
+            archive.add_bytes("unchanged.json", dump_json(unchanged))
+            cprint(f"Created unchanged.json with {len(unchanged)} entries.", Colors.OKGREEN)
 
-        # NEW: Write links.json
+        # NEW: Write links.json (always, restore relies on it to know the index is complete)
+        archive.add_bytes("links.json", dump_json(links))
         if links:
-            links_path = tempdir / "links.json"
-            with open(links_path, "w") as f:
-                json.dump(links, f, indent=2)
             cprint(f"Created links.json with {len(links)} entries.", Colors.OKGREEN)
 
-        # Determine output archive path and compression
-        from datetime import datetime
-        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-        ext = {
-            "none": ".tar",
-            "gz": ".tar.gz",
-            "zstd": ".tar.zst",
-            "zip": ".zip"
-        }[args.compress]
-
-        if args.output:
-            output_dir = Path(args.output)
-            if not output_dir.exists():
-                output_dir.mkdir(parents=True)
-        else:
-            output_dir = backups_dir
-
-        output = output_dir / f"backup_{ts}{ext}"
-
-        cprint(f"Creating archive at: {output}", Colors.HEADER)
-
-        # Compression logic
-        if args.compress == "none":
-            shutil.make_archive(str(output).replace(".tar", ""), "tar", tempdir)
-        elif args.compress == "gz":
-            shutil.make_archive(str(output).replace(".tar.gz", ""), "gztar", tempdir)
-        elif args.compress == "zip":
-            shutil.make_archive(str(output).replace(".zip", ""), "zip", tempdir)
-        elif args.compress == "zstd":
-            tar_path = str(output).replace(".tar.zst", ".tar")
-            shutil.make_archive(tar_path.replace(".tar", ""), "tar", tempdir)
-            subprocess.run(["zstd", "-f", tar_path, "-o", str(output)], check=True)
-            os.remove(tar_path)
-        else:
-            cprint(f"Unknown compression: {args.compress}", Colors.FAIL)
-            sys.exit(1)
+        def read_entry(entry):
+            """Returns (stat, permissions, file data, open file for large files)."""
+            kind, src, arcname = entry
+            if kind == "file" and arcname in unchanged:
+                # Only its permissions are recorded
+                st = os.stat(src)
+                return st, perm_record(st), None, None
+            if kind == "file":
+                f = open(src, "rb")
+                st = os.fstat(f.fileno())
+                if st.st_size <= READAHEAD_SIZE:
+                    with f:
+                        return st, perm_record(st), f.read(), None
+                # Large files are read later by the writer; queue their first
+                # blocks now so the disk works ahead of it
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+                os.posix_fadvise(f.fileno(), 0, WILLNEED_SIZE, os.POSIX_FADV_WILLNEED)
+                return st, perm_record(st), None, f
+            st = os.lstat(src)
+            if kind == "dir":
+                return st, perm_record(st), None, None
+            return st, None, None, None
+
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            if dry_run:
+                # Dry run archives synthetic empty members, the payload tree is never opened or stat()ed
+                prepared = itertools.repeat((None, None, None, None))
+            else:
+                prepared = ordered_map(pool, read_entry, entries, args.jobs * 4)
+            for (kind, src, arcname), (st, perm, data, f) in zip(entries, prepared):
+                if kind == "file" and arcname in unchanged:
+                    permissions[arcname] = perm
+                    if verbose:
+                        printer.enqueue(f"Unchanged since {unchanged[arcname]}: {src}", Colors.OKCYAN)
+                elif kind == "file":
+                    if f is not None:
+                        with f:
+                            padded = archive.add_file(arcname, st, fileobj=f)
+                        if padded:
+                            printer.enqueue(f"{src} shrank while it was being archived, padded with {padded} zero bytes", Colors.WARNING)
+                    else:
+                        archive.add_file(arcname, st, data=data)
+                    if perm is not None:
+                        permissions[arcname] = perm
+                    if verbose:
+                        printer.enqueue(f"Added file: {src} -> {arcname} (empty: {dry_run})", Colors.OKCYAN)
+                elif kind == "link":
+                    # The link itself is archived, its target lives in links.json
+                    target = links[arcname]["target"]
+                    archive.add_symlink(arcname, st, target)
+                    if verbose:
+                        printer.enqueue(f"Added symlink: {src} -> {target}", Colors.OKCYAN)
+                elif kind == "dirlink":
+                    # Directory symlinks are archived as an empty marker directory
+                    archive.add_dir(arcname)
+                    if verbose:
+                        printer.enqueue(f"Added directory symlink: {src} -> {links[arcname]['target']}", Colors.OKCYAN)
+                else:
+                    # Regular directory, record its permissions
+                    archive.add_dir(arcname, st)
+                    if perm is not None:
+                        permissions[arcname] = perm
+
+        # Write the permissions index
+        perm_name, perm_data = dump_permissions(permissions)
+        archive.add_bytes(perm_name, perm_data)
+        cprint(f"Created {perm_name} with {len(permissions)} entries.", Colors.OKGREEN)
+        archive.close()
+        os.replace(partial, output)
+    except BaseException:
+        # A finalized archive would look complete; a failed backup leaves none
+        archive.abort()
+        raise
 
-        cprint("Backup complete!", Colors.OKGREEN)
+    cprint("Backup complete!", Colors.OKGREEN)
 
 def prompt_overwrite(path):
+    printer.flush()
     while True:
         ans = input(f"File exists: {path}. Overwrite? (y/n): ").strip().lower()
         if ans in ("y", "yes"):
@@ -355,49 +1259,98 @@ def prompt_overwrite(path):
         elif ans in ("n", "no"):
             return False
 
-def is_same_file(src, dst, verbose=False):
-    """Return True if files exist and are byte-for-byte identical."""
+def prompt_conflicts(paths):
+    """Ask once about all differing files; return the set of paths to overwrite."""
+    printer.flush()
+    cprint(f"{len(paths)} existing file(s) differ from the backup:", Colors.WARNING)
+    for path in paths:
+        print(f"  {path}")
+    while True:
+        ans = input("Overwrite [a]ll, [n]one, or [s]elect each? ").strip().lower()
+        if ans in ("a", "all", "y", "yes"):
+            return set(paths)
+        elif ans in ("n", "none", "no"):
+            return set()
+        elif ans in ("s", "select"):
+            return {path for path in paths if prompt_overwrite(path)}
+
+# Files are compared in large chunks; big files get a cheap head/tail check first
+COMPARE_CHUNK = 1 << 20
+COMPARE_SAMPLE = 64 << 10
+COMPARE_SAMPLE_MIN = 64 << 20
+
+def same_content(src, dst, size):
+    """Return True if two files of the given (equal) size have the same bytes."""
+    with open(src, "rb") as a, open(dst, "rb") as b:
+        if size > COMPARE_SAMPLE_MIN:
+            tail = size - COMPARE_SAMPLE
+            if (os.pread(a.fileno(), COMPARE_SAMPLE, 0) != os.pread(b.fileno(), COMPARE_SAMPLE, 0)
+                    or os.pread(a.fileno(), COMPARE_SAMPLE, tail) != os.pread(b.fileno(), COMPARE_SAMPLE, tail)):
+                return False
+        while True:
+            chunk = a.read(COMPARE_CHUNK)
+            if chunk != b.read(COMPARE_CHUNK):
+                return False
+            if not chunk:
+                return True
+
+def same_as_data(path, data):
+    """Return True if path is a regular file holding exactly data."""
+    st = try_stat(path)
+    if st is None or not stat.S_ISREG(st.st_mode) or st.st_size != len(data):
+        return False
     try:
-        src_path = Path(src)
-        dst_path = Path(dst)
-        
-        # Check existence first
-        if not dst_path.exists() or not dst_path.is_file():
+        with open(path, "rb") as f:
+            return f.read(len(data) + 1) == data
+    except OSError:
+        return False
+
+def is_same_file(src, dst, verbose=False, src_st=None, dst_st=None):
+    """Return True if files exist and are byte-for-byte identical.
+
+    Callers that already stat()ed either side can pass the result to save a syscall.
+    """
+    try:
+        # One stat per side covers existence, type and size
+        dst_st = dst_st or try_stat(dst)
+        if dst_st is None or not stat.S_ISREG(dst_st.st_mode):
             if verbose:
-                cprint(f"Comparison: {dst} does not exist or is not a file", Colors.WARNING)
+                printer.enqueue(f"Comparison: {dst} does not exist or is not a file", Colors.WARNING)
             return False
-        if not src_path.exists() or not src_path.is_file():
+        src_st = src_st or try_stat(src)
+        if src_st is None or not stat.S_ISREG(src_st.st_mode):
             if verbose:
-                cprint(f"Comparison: {src} does not exist or is not a file", Colors.WARNING)
+                printer.enqueue(f"Comparison: {src} does not exist or is not a file", Colors.WARNING)
             return False
         
         # Check sizes first (quick comparison)
-        src_size = src_path.stat().st_size
-        dst_size = dst_path.stat().st_size
+        src_size = src_st.st_size
+        dst_size = dst_st.st_size
         if src_size != dst_size:
             if verbose:
-                cprint(f"Comparison: File sizes differ - {src}: {src_size} bytes, {dst}: {dst_size} bytes", Colors.WARNING)
+                printer.enqueue(f"Comparison: File sizes differ - {src}: {src_size} bytes, {dst}: {dst_size} bytes", Colors.WARNING)
             return False
         
         # Do full comparison if sizes match
-        is_identical = filecmp.cmp(src, dst, shallow=False)
+        is_identical = same_content(src, dst, src_size)
         if verbose:
             if is_identical:
-                cprint(f"Comparison: Files are identical - {src} and {dst}", Colors.OKGREEN)
+                printer.enqueue(f"Comparison: Files are identical - {src} and {dst}", Colors.OKGREEN)
             else:
-                cprint(f"Comparison: Files have different content - {src} and {dst}", Colors.WARNING)
+                printer.enqueue(f"Comparison: Files have different content - {src} and {dst}", Colors.WARNING)
         return is_identical
     except Exception as e:
         cprint(f"Error comparing files: {e}", Colors.WARNING)
         return False
 
-def handle_conflict(src, dst, dry_run, conflict, what="file", verbose=False):
-    # First check - dst might not exist yet
-    dst_path = Path(dst)
-    if not dst_path.exists():
+def handle_conflict(src, dst, dry_run, conflict, what="file", verbose=False, dst_exists=None):
+    # First check - dst might not exist yet (callers may have resolved this already)
+    if dst_exists is None:
+        dst_exists = Path(dst).exists()
+    if not dst_exists:
         if dry_run or verbose:
             msg = f"Would restore: {dst}" if dry_run else f"Restored: {dst}"
-            cprint(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKGREEN)
+            printer.enqueue(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKGREEN)
         return "restore"
 
     # Now check if identical
@@ -405,55 +1358,50 @@ def handle_conflict(src, dst, dry_run, conflict, what="file", verbose=False):
     if identical:
         # Always show skipping identical messages
         msg = f"Skipping identical {what}: {dst}"
-        cprint(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKCYAN)
+        printer.enqueue(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKCYAN)
         return "skip"
 
     # Different file exists - handle conflict
     if conflict == "overwrite":
         if dry_run or verbose:
             msg = f"Would overwrite: {dst}" if dry_run else f"Overwritten: {dst}"
-            cprint(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKGREEN)
+            printer.enqueue(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKGREEN)
         return "overwrite"
     elif conflict == "skip":
         if dry_run or verbose:
             msg = f"Would skip: {dst}" if dry_run else f"Skipped: {dst}"
-            cprint(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.WARNING)
+            printer.enqueue(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.WARNING)
         return "skip"
     else:
         if dry_run:
-            cprint(f"[DRY-RUN] Would ask: Overwrite existing {what} {dst}? (y/n)", Colors.OKCYAN)
+            printer.enqueue(f"[DRY-RUN] Would ask: Overwrite existing {what} {dst}? (y/n)", Colors.OKCYAN)
             return "ask"
         else:
             # Always show prompts
             if prompt_overwrite(dst):
                 if verbose:
-                    cprint(f"Overwritten: {dst}", Colors.OKGREEN)
+                    printer.enqueue(f"Overwritten: {dst}", Colors.OKGREEN)
                 return "overwrite"
             else:
                 if verbose:
-                    cprint(f"Skipped: {dst}", Colors.WARNING)
+                    printer.enqueue(f"Skipped: {dst}", Colors.WARNING)
                 return "skip"
 
 def compare_apt_repos(backup_apt_repos_file, verbose=False):
     """Compare backed up apt repos with current system repos."""
     try:
         # Generate current apt repos content using the same method as backup
-        current_sources = ""
-        if Path("/etc/apt/sources.list").exists():
-            current_sources += "### /etc/apt/sources.list\n"
-            current_sources += Path("/etc/apt/sources.list").read_text() + "\n"
-        current_sources += "### /etc/apt/sources.list.d/\n"
-        sources_list_d = Path("/etc/apt/sources.list.d")
-        if sources_list_d.exists():
-            for f in sorted(sources_list_d.glob("*.list")):
-                current_sources += f"## {f}\n"
-                current_sources += f.read_text() + "\n"
-        
-        # Read backed up sources
-        backup_sources = Path(backup_apt_repos_file).read_text()
-        
+        current_sources = build_apt_repos()
+
+        # Newer backups store a digest next to the sources, older ones are read in full
+        digest_file = Path(backup_apt_repos_file).with_suffix(".sha256")
+        try:
+            identical = hashlib.sha256(current_sources.encode()).hexdigest() == digest_file.read_text().strip()
+        except FileNotFoundError:
+            identical = current_sources == Path(backup_apt_repos_file).read_text()
+
         # Compare
-        if current_sources == backup_sources:
+        if identical:
             if verbose:
                 cprint(f"APT repos are identical to current system", Colors.OKGREEN)
             return True
@@ -465,16 +1413,12 @@ def compare_apt_repos(backup_apt_repos_file, verbose=False):
         cprint(f"Error comparing apt repos: {e}", Colors.WARNING)
         return False
 
+# "ii  <package>  <version> ..." lines of dpkg -l output
+_DPKG_RE = re.compile(r"^ii[ \t]+(\S+)[ \t]+(\S+)", re.M)
+
 def parse_dpkg_list(dpkg_text):
     """Parse dpkg -l output into a dict of {package: version}."""
-    packages = {}
-    for line in dpkg_text.splitlines():
-        if line.startswith("ii"):
-            parts = line.split()
-            if len(parts) >= 3:
-                pkg, ver = parts[1], parts[2]
-                packages[pkg] = ver
-    return packages
+    return dict(_DPKG_RE.findall(dpkg_text))
 
 def get_current_packages():
     """Get currently installed packages and versions as a dict."""
@@ -496,91 +1440,107 @@ def handle_package_restore(backup_pkg_file, dry_run=False, verbose=False):
     backup_pkgs = parse_dpkg_list(backup_pkg_file.read_text())
     current_pkgs = get_current_packages()
 
+    # Prompts happen up front; everything accepted goes to apt in one transaction
+    to_install = []
     for pkg, backup_ver in backup_pkgs.items():
         current_ver = current_pkgs.get(pkg)
         if current_ver == backup_ver:
             if verbose:
-                cprint(f"Package {pkg} already installed at version {backup_ver}.", Colors.OKCYAN)
+                printer.enqueue(f"Package {pkg} already installed at version {backup_ver}.", Colors.OKCYAN)
             continue
         elif current_ver is None:
-            cprint(f"Package {pkg} not installed. Will install version {backup_ver}.", Colors.OKGREEN)
-            if not dry_run:
-                subprocess.run(["sudo", "apt-get", "install", "-y", f"{pkg}={backup_ver}"], check=False)
+            printer.enqueue(f"Package {pkg} not installed. Will install version {backup_ver}.", Colors.OKGREEN)
+            to_install.append(f"{pkg}={backup_ver}")
         else:
-            # Compare versions
+            # Compare versions, parsing each only once
             from packaging import version
-            if version.parse(current_ver) < version.parse(backup_ver):
+            current_parsed, backup_parsed = version.parse(current_ver), version.parse(backup_ver)
+            if current_parsed < backup_parsed:
                 # Ask to update
                 ans = "y"
                 if not dry_run:
+                    printer.flush()
                     ans = input(f"Package {pkg} is installed at {current_ver}, backup has newer {backup_ver}. Update? (y/n): ").strip().lower()
                 if ans in ("y", "yes"):
-                    cprint(f"Updating {pkg} to {backup_ver}.", Colors.OKGREEN)
-                    if not dry_run:
-                        subprocess.run(["sudo", "apt-get", "install", "-y", f"{pkg}={backup_ver}"], check=False)
+                    printer.enqueue(f"Updating {pkg} to {backup_ver}.", Colors.OKGREEN)
+                    to_install.append(f"{pkg}={backup_ver}")
                 else:
-                    cprint(f"Skipped updating {pkg}.", Colors.WARNING)
-            elif version.parse(current_ver) > version.parse(backup_ver):
-                cprint(f"Package {pkg} is installed at newer version {current_ver} than backup {backup_ver}. Skipping downgrade.", Colors.WARNING)
+                    printer.enqueue(f"Skipped updating {pkg}.", Colors.WARNING)
+            elif current_parsed > backup_parsed:
+                printer.enqueue(f"Package {pkg} is installed at newer version {current_ver} than backup {backup_ver}. Skipping downgrade.", Colors.WARNING)
             else:
                 # Should not reach here, but just in case
-                cprint(f"Package {pkg} version mismatch: current {current_ver}, backup {backup_ver}.", Colors.WARNING)
+                printer.enqueue(f"Package {pkg} version mismatch: current {current_ver}, backup {backup_ver}.", Colors.WARNING)
 
-def restore(args):
-    import tempfile
-    import zipfile
+    if not to_install or dry_run:
+        return
+    cprint(f"Installing {len(to_install)} package(s)...", Colors.OKBLUE)
+    result = subprocess.run(["sudo", "apt-get", "install", "-y", *to_install], check=False)
+    if result.returncode != 0 and len(to_install) > 1:
+        # apt drops the whole transaction if one version is unavailable,
+        # retry one by one so the rest still gets installed
+        cprint("Batch install failed, installing packages one by one.", Colors.WARNING)
+        for spec in to_install:
+            subprocess.run(["sudo", "apt-get", "install", "-y", spec], check=False)
 
+def restore(args):
     backup_file = Path(args.restore)
     dry_run = args.dry_run
     conflict = args.conflict
     verbose = args.verbose
 
-    # 1. Detect archive type and extract
-    suffix = "".join(backup_file.suffixes)
+    # 1. Detect archive type and read the backup index
+    suffix = archive_suffix(backup_file)
     cprint(f"Detected archive type: {suffix}", Colors.OKBLUE)
+    if suffix not in ARCHIVE_SUFFIXES:
+        cprint(f"Unknown archive type: {suffix}", Colors.FAIL)
+        sys.exit(1)
+    check_decompressor(suffix)
+
+    # Only the small bookkeeping files are extracted to the temp dir, the
+    # payload is later streamed straight to its destination
     tempdir = tempfile.TemporaryDirectory()
     temp_path = Path(tempdir.name)
+    archive = RestoreArchive(backup_file, suffix)
 
-    # Extraction
-    if suffix == ".zip":
-        with zipfile.ZipFile(backup_file, "r") as zf:
-            zf.extractall(temp_path)
-    elif suffix == ".tar":
-        with tarfile.open(backup_file, "r") as tf:
-            tf.extractall(temp_path)
-    elif suffix == ".tar.gz":
-        with tarfile.open(backup_file, "r:gz") as tf:
-            tf.extractall(temp_path)
-    elif suffix == ".tar.zst":
-        check_zstd()
-        import subprocess
-        tmp_tar = temp_path / "archive.tar"
-        subprocess.run(["zstd", "-d", "-c", str(backup_file)], stdout=open(tmp_tar, "wb"), check=True)
-        with tarfile.open(tmp_tar, "r") as tf:
-            tf.extractall(temp_path)
-        tmp_tar.unlink()
-    else:
-        cprint(f"Unknown archive type: {suffix}", Colors.FAIL)
-        tempdir.cleanup()
-        sys.exit(1)
+    def extract_index_file(name, member):
+        if name.startswith("/") or ".." in name.split("/"):
+            return
+        dest = temp_path / name
+        if not dest.exists():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            archive.extract(member, dest)
 
-    cprint(f"Archive extracted to temp dir: {temp_path}", Colors.OKBLUE)
+    archive.open()
+    try:
+        for name, member in archive.members():
+            if name.startswith(PAYLOAD_DIRS):
+                # Current backups store their index in front of the payload,
+                # older ones have links.json/permissions.json after it
+                # (zip has a central directory, so reading all of it costs nothing)
+                if (archive.zip is None and (temp_path / "links.json").exists()
+                        and ((temp_path / "affiliation.tsv").exists() or (temp_path / "affiliation.json").exists())):
+                    break
+                continue
+            if archive.is_file(member):
+                extract_index_file(name, member)
+    finally:
+        archive.close()
+
+    cprint(f"Backup index extracted to temp dir: {temp_path}", Colors.OKBLUE)
 
-    # 2. Read affiliation.json
-    affil_path = temp_path / "affiliation.json"
-    if not affil_path.exists():
-        cprint("affiliation.json not found in backup!", Colors.FAIL)
+    # 2. Read the affiliation map (affiliation.tsv, or affiliation.json in older backups)
+    affiliation = load_affiliation(temp_path)
+    if affiliation is None:
+        cprint("affiliation.tsv/affiliation.json not found in backup!", Colors.FAIL)
         tempdir.cleanup()
         sys.exit(1)
-    with open(affil_path, "r") as f:
-        affiliation = json.load(f)
         
     # NEW: Read links.json if it exists
     links = {}
     links_path = temp_path / "links.json"
     if links_path.exists():
-        with open(links_path, "r") as f:
-            links = json.load(f)
+        links = load_json(links_path)
         cprint(f"Found links.json with {len(links)} entries.", Colors.OKBLUE)
 
     # 3. Handle metadata
@@ -643,45 +1603,201 @@ def restore(args):
         if meta_path.exists():
             handle_package_restore(meta_path, dry_run=dry_run, verbose=verbose)
 
-    # 4. Restore files
+    # 4. Restore files, streamed from the archive straight to their destinations
     cprint("Restoring files...", Colors.HEADER)
-    for archive_rel, orig_path in affiliation.items():
-        src = temp_path / archive_rel
-        dst = Path(orig_path)
-        if not src.exists():
-            cprint(f"Warning: Archive file missing: {archive_rel}", Colors.WARNING)
-            continue
+    # Resolve which destinations already exist with one scandir per parent directory
+    listed_dirs = set()
+    existing = scan_existing(affiliation.values(), listed_dirs)
+    # Directories known to exist, reused by the symlink pass
+    known_dirs = set(listed_dirs)
+    if not dry_run:
+        # Every missing destination gets its parent directory up front,
+        # instead of one mkdir(parents=True) per restored file. Parents that
+        # were just listed exist already and are skipped.
+        known_dirs.update(make_parent_dirs((p for p in affiliation.values() if p not in existing), listed_dirs))
+    seen = set()
+    # Files that need no prompt are written by a thread pool. Members of a
+    # compressed stream are read here in archive order and handed over in memory.
+    pool = ThreadPoolExecutor(max_workers=args.jobs)
+    writes = deque()
+    max_writes = args.jobs * 4
+    # (dst, staged copy) of files that differ, when --conflict leaves it to the user
+    conflicts = []
 
-        # Check if it's a symbolic link
-        if archive_rel in links:
-            # Skip direct file restoration for links - we'll handle them in a separate pass
-            if verbose:
-                cprint(f"Skipping direct restoration of {dst} as it will be created as a symlink", Colors.OKCYAN)
-            continue
-        elif src.is_file():
-            result = handle_conflict(src, dst, dry_run, conflict, what="file", verbose=verbose)
-            if result == "restore" and not dry_run:
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(src, dst)
-            elif result == "overwrite" and not dry_run:
-                shutil.copy2(src, dst)
+    def guarded(fn, archive, member, dst, *fn_args):
+        """Run fn(archive, member, dst, ...) for one file; an OSError only skips that file."""
+        try:
+            fn(archive, member, dst, *fn_args)
+        except OSError as e:
+            printer.enqueue(f"Failed to restore {dst}: {e}", Colors.FAIL)
+
+    def dispatch(archive, fn, member, *fn_args):
+        """Run fn(archive, member, *fn_args, data) on the pool, or inline for large streamed members."""
+        if archive.can_extract_concurrently(member):
+            writes.append(pool.submit(guarded, fn, archive, member, *fn_args))
+        elif archive.size(member) <= READAHEAD_SIZE:
+            writes.append(pool.submit(guarded, fn, archive, member, *fn_args, archive.read(member)))
         else:
-            # Create directories if they don't exist
-            if not dst.exists() and not dry_run:
-                dst.mkdir(parents=True, exist_ok=True)
+            guarded(fn, archive, member, *fn_args)
+        # Bound the data held by queued writes
+        while len(writes) > max_writes:
+            writes.popleft().result()
+
+    def resolve_conflict(archive, member, dst, data=None):
+        """Extract member to a staging file, then compare and overwrite dst or drop it."""
+        try:
+            dst_mode = os.lstat(dst).st_mode
+        except FileNotFoundError:
+            dst_mode = stat.S_IFREG
+        if not stat.S_ISREG(dst_mode):
+            # A directory, symlink or special file is never replaced by a file
+            printer.enqueue(f"Skipping {dst}: it exists but is not a regular file", Colors.WARNING)
+            return
+        # Small members are checked against dst from memory, so an identical
+        # file costs one read of dst and no staging copy
+        if data is None and archive.size(member) <= READAHEAD_SIZE:
+            data = archive.read(member)
+        if data is not None and same_as_data(dst, data):
+            msg = f"Skipping identical file: {dst}"
+            printer.enqueue(f"[DRY-RUN] {msg}" if dry_run else msg, Colors.OKCYAN)
+            return
+        # Staged next to dst, so an overwrite is a single rename instead of a
+        # second copy; a dry run stages in the private temp dir
+        fd, staging = create_staging(os.path.join(tempdir.name, "staging") if dry_run else dst)
+        try:
+            archive.extract(member, fd, data)
+            if conflict is None and not dry_run:
+                # Differing files are asked about together after the payload
+                # pass, their staged copies wait next to them until then
+                if is_same_file(staging, dst, verbose):
+                    printer.enqueue(f"Skipping identical file: {dst}", Colors.OKCYAN)
+                else:
+                    conflicts.append((dst, staging))
+                    staging = None
+                return
+            result = handle_conflict(staging, dst, dry_run, conflict, what="file", verbose=verbose, dst_exists=True)
+            if result == "overwrite" and not dry_run:
+                os.replace(staging, dst)
+        finally:
+            if staging is not None and os.path.lexists(staging):
+                os.unlink(staging)
+
+    def restore_payload(archive, only=None):
+        """Stream one archive's payload to its destinations, optionally just the members in only."""
+        archive.open()
+        try:
+            for archive_rel, member in archive.members():
+                if not archive_rel.startswith(PAYLOAD_DIRS):
+                    # Index files stored after the payload (the permissions index)
+                    if only is None and archive.is_file(member):
+                        extract_index_file(archive_rel, member)
+                    continue
+                if only is not None and archive_rel not in only:
+                    continue
+                orig_path = affiliation.get(archive_rel)
+                if orig_path is None:
+                    continue
+                seen.add(archive_rel)
+                # Plain strings from here on, this loop runs once per archive member
+                dst = orig_path
+                dst_exists = dst in existing
+
+                # Check if it's a symbolic link
+                if archive_rel in links:
+                    # Skip direct file restoration for links - we'll handle them in a separate pass
+                    if verbose:
+                        printer.enqueue(f"Skipping direct restoration of {dst} as it will be created as a symlink", Colors.OKCYAN)
+                    continue
+                elif archive.is_file(member):
+                    if not dst_exists:
+                        handle_conflict(None, dst, dry_run, conflict, what="file", verbose=verbose, dst_exists=False)
+                        if not dry_run:
+                            dispatch(archive, RestoreArchive.extract, member, dst)
+                        continue
+                    if not dry_run:
+                        # Nothing prompts here, conflicts are resolved on the pool too
+                        dispatch(archive, resolve_conflict, member, dst)
+                    else:
+                        guarded(resolve_conflict, archive, member, dst)
+                elif archive.is_dir(member):
+                    # Create directories if they don't exist
+                    if not dst_exists and not dry_run:
+                        os.makedirs(dst, exist_ok=True)
+                        if verbose:
+                            printer.enqueue(f"Created directory: {dst}", Colors.OKGREEN)
+            # Writes may still read from this archive
+            while writes:
+                writes.popleft().result()
+        finally:
+            archive.close()
+
+    try:
+        restore_payload(archive)
+
+        # Files left out of an incremental backup come from the backups holding their data
+        unchanged_path = temp_path / "unchanged.json"
+        unchanged = load_json(unchanged_path) if unchanged_path.exists() else {}
+        by_holder = {}
+        for archive_rel, holder in unchanged.items():
+            by_holder.setdefault(holder, set()).add(archive_rel)
+        # Unchanged files none of the base backups could supply; they fail the restore
+        lost = 0
+        for holder, members in by_holder.items():
+            holder_path = backup_file.parent / holder
+            holder_suffix = archive_suffix(holder_path)
+            if not holder_path.is_file() or holder_suffix not in ARCHIVE_SUFFIXES:
+                cprint(f"Base backup {holder_path} not found, {len(members)} unchanged file(s) can't be restored.", Colors.FAIL)
+                lost += len(members)
+                continue
+            cprint(f"Restoring {len(members)} unchanged file(s) from {holder}...", Colors.OKBLUE)
+            check_decompressor(holder_suffix)
+            restore_payload(RestoreArchive(holder_path, holder_suffix), only=members)
+            missing = members - seen
+            if missing:
+                cprint(f"Base backup {holder_path} lacks {len(missing)} unchanged file(s) this backup relies on.", Colors.FAIL)
+                lost += len(missing)
+        pool.shutdown()
+
+        if conflicts:
+            conflicts.sort()
+            chosen = prompt_conflicts([dst for dst, _ in conflicts])
+            for dst, staging in conflicts:
+                if dst not in chosen:
+                    os.unlink(staging)
+                    if verbose:
+                        printer.enqueue(f"Skipped: {dst}", Colors.WARNING)
+                    continue
+                try:
+                    os.replace(staging, dst)
+                except OSError as e:
+                    os.unlink(staging)
+                    printer.enqueue(f"Failed to restore {dst}: {e}", Colors.FAIL)
+                    continue
                 if verbose:
-                    cprint(f"Created directory: {dst}", Colors.OKGREEN)
+                    printer.enqueue(f"Overwritten: {dst}", Colors.OKGREEN)
+            conflicts.clear()
+    finally:
+        pool.shutdown()
+        # Staged copies left over when the restore was interrupted
+        for _, staging in conflicts:
+            if os.path.lexists(staging):
+                os.unlink(staging)
+
+    for archive_rel in affiliation.keys() - seen:
+        printer.enqueue(f"Warning: Archive file missing: {archive_rel}", Colors.WARNING)
 
     # NEW: Restore symlinks in a separate pass
     if links:
         cprint("Restoring symbolic links...", Colors.HEADER)
+        # Links still to create, grouped by parent directory
+        link_parents = {}
         for archive_rel, link_info in links.items():
             # Get the original path from affiliation
             if archive_rel not in affiliation:
-                cprint(f"Warning: Link entry {archive_rel} not found in affiliation.json", Colors.WARNING)
+                printer.enqueue(f"Warning: Link entry {archive_rel} not found in affiliation map", Colors.WARNING)
                 continue
                 
-            dst = Path(affiliation[archive_rel])
+            dst = affiliation[archive_rel]
             target = link_info["target"]
             is_dir = link_info.get("is_dir", False)
             
@@ -690,103 +1806,217 @@ def restore(args):
                 # Target remains as stored - it's already relative
                 pass
                 
-            # Handle link creation
-            if dst.exists():
-                if dst.is_symlink():
+            # Handle link creation, one lstat() tells whether and what is in the way.
+            # Paths missing from a parent listed before the payload pass need none.
+            remove = None
+            try:
+                dst_st = None
+                if dst in existing or os.path.dirname(dst) not in listed_dirs:
+                    dst_st = os.lstat(dst)
+            except FileNotFoundError:
+                dst_st = None
+            if dst_st is not None:
+                if stat.S_ISLNK(dst_st.st_mode):
                     current_target = os.readlink(dst)
                     if current_target == target:
                         if verbose:
-                            cprint(f"Symlink already exists with correct target: {dst} -> {target}", Colors.OKCYAN)
+                            printer.enqueue(f"Symlink already exists with correct target: {dst} -> {target}", Colors.OKCYAN)
                         continue
                     elif conflict == "overwrite":
-                        if not dry_run:
-                            dst.unlink()
-                        else:
-                            cprint(f"[DRY-RUN] Would overwrite symlink: {dst} -> {target}", Colors.OKGREEN)
+                        remove = "unlink"
+                        if dry_run:
+                            printer.enqueue(f"[DRY-RUN] Would overwrite symlink: {dst} -> {target}", Colors.OKGREEN)
                     elif conflict == "skip":
                         if verbose:
-                            cprint(f"Skipping existing symlink: {dst}", Colors.WARNING)
+                            printer.enqueue(f"Skipping existing symlink: {dst}", Colors.WARNING)
                         continue
                     else:
                         if dry_run:
-                            cprint(f"[DRY-RUN] Would ask to overwrite symlink: {dst}", Colors.OKCYAN)
+                            printer.enqueue(f"[DRY-RUN] Would ask to overwrite symlink: {dst}", Colors.OKCYAN)
                             continue
                         elif not prompt_overwrite(dst):
                             if verbose:
-                                cprint(f"Skipped symlink: {dst}", Colors.WARNING)
+                                printer.enqueue(f"Skipped symlink: {dst}", Colors.WARNING)
                             continue
                         else:
-                            if not dry_run:
-                                dst.unlink()
+                            remove = "unlink"
                 else:
                     # Handle conflict with existing non-symlink
-                    result = handle_conflict(temp_path / archive_rel, dst, dry_run, conflict, what="symlink", verbose=verbose)
+                    result = handle_conflict(temp_path / archive_rel, dst, dry_run, conflict, what="symlink", verbose=verbose, dst_exists=True)
                     if result != "overwrite":
                         continue
-                    if not dry_run:
-                        # Remove existing file/dir to make way for symlink
-                        if dst.is_dir():
-                            shutil.rmtree(dst)
-                        else:
-                            dst.unlink()
+                    # Remove existing file/dir to make way for symlink
+                    remove = "rmtree" if stat.S_ISDIR(dst_st.st_mode) else "unlink"
             
             # Create the symlink
             if not dry_run:
-                # Make sure parent directory exists
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Create the symlink
+                parent, name = os.path.split(dst)
+                link_parents.setdefault(parent, []).append((name, target, is_dir, remove))
+            else:
+                printer.enqueue(f"[DRY-RUN] Would create symlink: {dst} -> {target}", Colors.OKGREEN)
+
+        # Links are created directory by directory, relative to one open
+        # descriptor of their parent, so the kernel resolves each parent path
+        # once. Decisions and prompts are done, so directories run in parallel.
+        link_errors = []
+        # (link path, future) of directories swapped out by exchange_paths()
+        old_trees = []
+
+        def create_links(parent, group):
+            """Create one directory's symlinks, removing first whatever the first pass chose to replace."""
+            fd = None
+            try:
+                # Make sure parent directory exists; links are in affiliation too,
+                # so their parents were normally made before the payload pass
+                if parent not in known_dirs:
+                    os.makedirs(parent, exist_ok=True)
+                if os.symlink in os.supports_dir_fd:
+                    fd = os.open(parent, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError as e:
+                link_errors.extend((os.path.join(parent, name), target, e) for name, target, _, _ in group)
+                return
+            try:
+                for name, target, is_dir, remove in group:
+                    dst = os.path.join(parent, name)
+                    # Relative to the parent's descriptor when there is one
+                    where = name if fd is not None else dst
+                    tmp = staging_name(name)
+                    tmp_where = tmp if fd is not None else os.path.join(parent, tmp)
+                    try:
+                        if remove == "rmtree":
+                            # The link goes live in one rename that swaps it with the
+                            # directory; deleting the old tree then runs on the pool
+                            os.symlink(target, tmp_where, dir_fd=fd)
+                            swapped = False
+                            try:
+                                swapped = exchange_paths(tmp_where, where, fd)
+                            finally:
+                                if not swapped:
+                                    os.unlink(tmp_where, dir_fd=fd)
+                            if swapped:
+                                old_trees.append((dst, link_pool.submit(shutil.rmtree, os.path.join(parent, tmp))))
+                            else:
+                                shutil.rmtree(dst)
+                                os.symlink(target, where, target_is_directory=is_dir, dir_fd=fd)
+                        elif remove == "unlink":
+                            # Renamed over the old file or link, so dst never goes missing
+                            os.symlink(target, tmp_where, target_is_directory=is_dir, dir_fd=fd)
+                            try:
+                                os.replace(tmp_where, where, src_dir_fd=fd, dst_dir_fd=fd)
+                            except OSError:
+                                os.unlink(tmp_where, dir_fd=fd)
+                                raise
+                        else:
+                            os.symlink(target, where, target_is_directory=is_dir, dir_fd=fd)
+                        if verbose:
+                            printer.enqueue(f"Created symlink: {dst} -> {target}", Colors.OKGREEN)
+                    except OSError as e:
+                        link_errors.append((dst, target, e))
+            finally:
+                if fd is not None:
+                    os.close(fd)
+
+        with ThreadPoolExecutor(max_workers=args.jobs) as link_pool:
+            for _ in link_pool.map(create_links, link_parents, link_parents.values()):
+                pass
+            for dst, future in old_trees:
                 try:
-                    os.symlink(target, dst, target_is_directory=is_dir)
-                    if verbose:
-                        cprint(f"Created symlink: {dst} -> {target}", Colors.OKGREEN)
+                    future.result()
                 except OSError as e:
-                    cprint(f"Failed to create symlink {dst} -> {target}: {e}", Colors.FAIL)
-            else:
-                cprint(f"[DRY-RUN] Would create symlink: {dst} -> {target}", Colors.OKGREEN)
+                    printer.enqueue(f"Replaced {dst} with a symlink, but failed to delete the old directory: {e}", Colors.WARNING)
+        for dst, target, e in link_errors:
+            printer.enqueue(f"Failed to create symlink {dst} -> {target}: {e}", Colors.FAIL)
 
     # Restore permissions unless --no-perm
-    perm_path = temp_path / "permissions.json"
-    permissions = {}
-    if perm_path.exists():
-        with open(perm_path, "r") as f:
-            permissions = json.load(f)
+    permissions = iter([])
+    if (temp_path / "permissions.bin").exists() or (temp_path / "permissions.json").exists():
+        if not args.no_perm:
+            permissions = iter_permissions(temp_path)
     else:
-        cprint("permissions.json not found in backup! Permissions will not be restored.", Colors.WARNING)
+        cprint("No permissions index found in backup! Permissions will not be restored.", Colors.WARNING)
 
-    if not args.no_perm and permissions:
+    first = next(permissions, None)
+    if not args.no_perm and first is not None:
         cprint("Restoring file permissions and ownership...", Colors.OKBLUE)
-        for rel_path, perm in permissions.items():
-            dst = Path(affiliation.get(rel_path, rel_path))
+        # One stat() per file first: it doubles as the existence check and
+        # tells which of chmod()/chown() are actually needed. Only files that
+        # need either are kept, so this holds little more than the changes.
+        pending = []
+        # Entries come in archive order, so siblings share one open parent
+        parent_dir = ParentDir()
+        for rel_path, mode, backup_uid, backup_gid, user, group in itertools.chain([first], permissions):
+            dst = affiliation.get(rel_path, rel_path)
             # NEW: Resolve UID and GID from username and group name
+            uid = backup_uid
+            gid = backup_gid
+
+            if user is not None: # NEW
+                uid = user_id(user)
+                if uid is None:
+                    printer.enqueue(f"Warning: User '{user}' not found on this system. Skipping ownership for {dst}", Colors.WARNING)
+                    continue # Skip ownership restoration for this file
+
+            if group is not None: # NEW
+                gid = group_id(group)
+                if gid is None:
+                    printer.enqueue(f"Warning: Group '{group}' not found on this system. Skipping ownership for {dst}", Colors.WARNING)
+                    continue # Skip ownership restoration for this file
+
             try:
-                uid = perm["uid"]
-                gid = perm["gid"]
-                
-                if "user" in perm: # NEW
-                    try:
-                        uid = pwd.getpwnam(perm["user"]).pw_uid
-                    except KeyError:
-                        cprint(f"Warning: User '{perm['user']}' not found on this system. Skipping ownership for {dst}", Colors.WARNING)
-                        continue # Skip ownership restoration for this file
-                
-                if "group" in perm: # NEW
-                    try:
-                        gid = grp.getgrnam(perm["group"]).gr_gid
-                    except KeyError:
-                        cprint(f"Warning: Group '{perm['group']}' not found on this system. Skipping ownership for {dst}", Colors.WARNING)
-                        continue # Skip ownership restoration for this file
-
-                if dst.exists():
-                    os.chmod(dst, perm["mode"])
-                    os.chown(dst, uid, gid) # Use resolved uid, gid
-                    if args.verbose:
-                        cprint(f"Set permissions for {dst}: mode={oct(perm['mode'])}, uid={perm['uid']}, gid={perm['gid']}", Colors.OKCYAN)
+                name, dir_fd = parent_dir.at(dst)
+                st = os.stat(name, dir_fd=dir_fd)
+            except FileNotFoundError:
+                continue
             except Exception as e:
-                cprint(f"Failed to set permissions for {dst}: {e}", Colors.WARNING)
+                printer.enqueue(f"Failed to set permissions for {dst}: {e}", Colors.WARNING)
+                continue
+            chown = st.st_uid != uid or st.st_gid != gid
+            if chown or stat.S_IMODE(st.st_mode) != stat.S_IMODE(mode):
+                pending.append((os.path.dirname(dst), st.st_ino, dst, mode, uid, gid, chown, backup_uid, backup_gid))
+            elif verbose:
+                printer.enqueue(f"Set permissions for {dst}: mode={oct(mode)}, uid={backup_uid}, gid={backup_gid}", Colors.OKCYAN)
+
+        # Grouped by directory, for the open parent, and in inode order within
+        # it, which roughly follows where the inodes sit on disk
+        pending.sort(key=lambda p: (p[0], p[1]))
+        parent_dir.close()
+        if dry_run:
+            # Decided once for the whole pass: a dry run only lists what would change
+            for _, _, dst, mode, _, _, _, backup_uid, backup_gid in pending:
+                printer.enqueue(f"[DRY-RUN] Would set permissions for {dst}: mode={oct(mode)}, uid={backup_uid}, gid={backup_gid}", Colors.OKCYAN)
+        else:
+            def apply_permissions(group):
+                """chown/chmod one directory's entries through its own open parent."""
+                group_dir = ParentDir()
+                try:
+                    for _, _, dst, mode, uid, gid, chown, backup_uid, backup_gid in group:
+                        try:
+                            name, dir_fd = group_dir.at(dst)
+                            # chown() may clear setuid/setgid bits, so the mode is set after it
+                            if chown:
+                                os.chown(name, uid, gid, dir_fd=dir_fd) # Use resolved uid, gid
+                            os.chmod(name, mode, dir_fd=dir_fd)
+                            if verbose:
+                                printer.enqueue(f"Set permissions for {dst}: mode={oct(mode)}, uid={backup_uid}, gid={backup_gid}", Colors.OKCYAN)
+                        except FileNotFoundError:
+                            pass
+                        except Exception as e:
+                            printer.enqueue(f"Failed to set permissions for {dst}: {e}", Colors.WARNING)
+                finally:
+                    group_dir.close()
+
+            # Directories are independent, so each one's entries go to the pool as a unit
+            groups = [list(group) for _, group in itertools.groupby(pending, key=lambda p: p[0])]
+            with ThreadPoolExecutor(max_workers=args.jobs) as perm_pool:
+                for _ in perm_pool.map(apply_permissions, groups):
+                    pass
     elif args.no_perm:
         cprint("Skipping permission and ownership restoration (--no-perm set).", Colors.WARNING)
 
+    if lost:
+        cprint(f"Restore incomplete: {lost} unchanged file(s) could not be restored from the base backups.", Colors.FAIL)
+        tempdir.cleanup()
+        sys.exit(1)
     cprint("Restore complete!" if not dry_run else "[DRY-RUN] Restore simulation complete!", Colors.OKBLUE)
     tempdir.cleanup()
 
@@ -802,9 +2032,14 @@ def main():
     )
     parser.add_argument(
         "--compress",
-        choices=["none", "gz", "zstd", "zip"],
+        choices=["none", "gz", "zstd", "lz4", "zip"],
         default="none",
-        help="Choose compression method."
+        help="Choose compression method. lz4 is optimized for throughput at the cost of some compression ratio."
+    )
+    parser.add_argument(
+        "--compress-level",
+        type=int,
+        help="Compression level for zstd (1-19, default 3), gz (1-9, default 6) or lz4 (1-12, default 1)."
     )
     parser.add_argument(
         "--output",
@@ -836,6 +2071,19 @@ def main():
         type=str,
         help="Script to run after restore (local path or URL)."
     )
+    parser.add_argument(
+        "--jobs",
+        type=positive_int,
+        default=default_jobs(),
+        help="Number of worker threads used to read files on backup and to write files, symlinks and permissions on restore (default: 2x CPU count, max 32)."
+    )
+    parser.add_argument(
+        "--incremental-base",
+        type=str,
+        metavar="BACKUP_FILE",
+        help="Previous backup to build on: files with the same size and mtime are not stored again. "
+             "Restoring needs that backup (and the ones it builds on) in the same directory."
+    )
     parser.add_argument(
         "--no-perm",
         action="store_true",
@@ -862,6 +2110,10 @@ def main():
 
     args = parser.parse_args()
 
+    hooks = [f"--{name}" for name in ("prebak", "postbak", "prerest", "postrest") if getattr(args, name)]
+    if hooks:
+        cprint(f"Hook scripts are not implemented yet, ignoring {', '.join(hooks)}.", Colors.WARNING)
+
     if args.backup:
         backup(args)
     elif args.restore: